@@ -259,6 +259,7 @@ def fetch_jsonld_columns(df: SomeFrame) -> SomeFrame:
                 retry_count=11,
                 ok_statuses={200, 404},
                 bad_statuses={502},
+                keep_headers=["Date"],
             )
             .alias("response")
         )
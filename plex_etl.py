@@ -1,6 +1,6 @@
 import os
 import sys
-from typing import Literal
+from typing import Literal, get_args
 
 import polars as pl
 
@@ -16,10 +16,10 @@ from sparql import sparql
 
 GUID_TYPE = Literal["episode", "movie", "season", "show"]
 
-_GUID_RE = r"plex://(?P<type>episode|movie|season|show)/(?P<key>[a-f0-9]{24})"
 _ANY_KEY_RE = r"(plex://(episode|movie|season|show)/)?([a-f0-9]{24})"
 
 _PLEX_API_RETRY_COUNT = 5
+_PLEX_API_MAX_WORKERS = 8
 
 _PLEX_DEVICE_DTYPE = pl.Struct(
     {
@@ -65,15 +65,30 @@ def plex_server(name: str) -> pl.LazyFrame:
     )
 
 
+def _plex_guid_type_str(expr: pl.Expr) -> pl.Expr:
+    return expr.str.head(-25).str.slice(len("plex://"))
+
+
+def _is_plex_guid(expr: pl.Expr) -> pl.Expr:
+    return (
+        expr.str.starts_with("plex://")
+        & (expr.str.slice(-25, 1) == "/")
+        & _plex_guid_type_str(expr).is_in(get_args(GUID_TYPE))
+        & expr.str.slice(-24).str.contains(r"^[0-9a-f]{24}$")
+    )
+
+
 def _decode_plex_guid_key(expr: pl.Expr) -> pl.Expr:
-    return expr.str.extract(_GUID_RE, 2).str.decode("hex")
+    # The then branch is also evaluated on rejected rows, so decode leniently
+    return pl.when(_is_plex_guid(expr)).then(
+        expr.str.slice(-24).str.decode("hex", strict=False)
+    )
 
 
 def plex_library_guids() -> pl.LazyFrame:
     return (
         plex_server(name=os.environ["PLEX_SERVER"])
-        .with_columns(pl.lit(pl.Series([[1, 2]])).alias("section"))
-        .explode("section")
+        .join(pl.LazyFrame({"section": [1, 2]}), how="cross")
         .select(
             pl.format("{}/library/sections/{}/all", pl.col("uri"), pl.col("section"))
             .pipe(prepare_request, headers={"X-Plex-Token": pl.col("accessToken")})
@@ -159,18 +174,20 @@ def plex_search_guids(df: pl.LazyFrame) -> pl.LazyFrame:
                 request,
                 log_group="plex_metadata_search",
                 retry_count=_PLEX_API_RETRY_COUNT,
+                max_workers=_PLEX_API_MAX_WORKERS,
             )
             .pipe(response_text)
             .str.json_decode(_SEARCH_METACONTAINER_JSON_DTYPE)
             .struct.field("MediaContainer")
             .struct.field("SearchResults")
-            .list.eval(
-                pl.element()
-                .struct.field("SearchResult")
-                .list.eval(pl.element().struct.field("Metadata").struct.field("guid"))
-                .flatten()
-            )
-            .flatten()
+        )
+        .explode("SearchResults")
+        .select(pl.col("SearchResults").struct.field("SearchResult"))
+        .explode("SearchResult")
+        .select(
+            pl.col("SearchResult")
+            .struct.field("Metadata")
+            .struct.field("guid")
             .alias("guid")
         )
         .unique("guid")
@@ -236,11 +253,15 @@ def wikidata_search_guids(limit: int = _SEARCH_LIMIT) -> pl.LazyFrame:
 
 
 def _decode_plex_guid_type(expr: pl.Expr) -> pl.Expr:
-    return expr.str.extract(_GUID_RE, 1).cast(pl.Categorical)
+    return (
+        pl.when(_is_plex_guid(expr))
+        .then(_plex_guid_type_str(expr))
+        .cast(pl.Categorical)
+    )
 
 
 def _sort(df: SomeFrame) -> SomeFrame:
-    return df.sort(by=pl.col("key").bin.encode("hex"))
+    return df.sort(by="key")
 
 
 _METADATA_DTYPE = pl.Struct(
@@ -260,16 +281,28 @@ _METACONTAINER_JSON_DTYPE = pl.Struct(
 )
 
 
-def _extract_guid(pattern: str) -> pl.Expr:
+_EXTERNAL_GUID_RE = r"(?P<source>imdb://(?:tt|nm)|tmdb://|tvdb://)(?P<id>\d+)"
+
+
+def _extract_external_guids() -> pl.Expr:
     return (
         pl.col("metadata")
         .struct.field("Guid")
+        .list.eval(
+            pl.element().struct.field("id").str.extract_groups(_EXTERNAL_GUID_RE)
+        )
+        .alias("external_guids")
+    )
+
+
+def _extract_guid(source: Literal["imdb", "tmdb", "tvdb"]) -> pl.Expr:
+    return (
+        pl.col("external_guids")
         .list.eval(
             pl.element()
+            .filter(pl.element().struct.field("source").str.starts_with(source))
             .struct.field("id")
-            .str.extract(pattern, 1)
-            .cast(pl.UInt32)
-            .drop_nulls(),
+            .cast(pl.UInt32),
         )
         .list.first()
     )
@@ -296,6 +329,8 @@ def fetch_metadata_guids(df: pl.LazyFrame) -> pl.LazyFrame:
                 bad_statuses={502, 504, 520},
                 retry_count=_PLEX_API_RETRY_COUNT,
                 timeout=60.0,
+                max_workers=_PLEX_API_MAX_WORKERS,
+                keep_headers=["Date"],
             ),
         )
         .with_columns(
@@ -306,8 +341,11 @@ def fetch_metadata_guids(df: pl.LazyFrame) -> pl.LazyFrame:
                 .cast(pl.Datetime(time_unit="ns"))
                 .alias("retrieved_at")
             ),
+        )
+        .with_columns(
             (
-                pl.col("response")
+                pl.when(pl.col("status_code") == 200)
+                .then(pl.col("response"))
                 .pipe(response_text)
                 .str.json_decode(_METACONTAINER_JSON_DTYPE)
                 .struct.field("MediaContainer")
@@ -316,15 +354,17 @@ def fetch_metadata_guids(df: pl.LazyFrame) -> pl.LazyFrame:
                 .alias("metadata")
             ),
         )
+        .drop("response")
+        .with_columns(_extract_external_guids())
         .select(
             pl.col("key"),
             pl.col("metadata").struct.field("type").cast(pl.Categorical).alias("type"),
             (pl.col("status_code") == 200).alias("success"),
             pl.col("retrieved_at"),
             pl.col("metadata").struct.field("year").alias("year"),
-            _extract_guid(r"imdb://(?:tt|nm)(\d+)").alias("imdb_numeric_id"),
-            _extract_guid(r"tmdb://(\d+)").alias("tmdb_id"),
-            _extract_guid(r"tvdb://(\d+)").alias("tvdb_id"),
+            _extract_guid("imdb").alias("imdb_numeric_id"),
+            _extract_guid("tmdb").alias("tmdb_id"),
+            _extract_guid("tvdb").alias("tvdb_id"),
             (
                 pl.col("metadata")
                 .struct.field("Similar")
@@ -335,7 +375,9 @@ def fetch_metadata_guids(df: pl.LazyFrame) -> pl.LazyFrame:
     )
 
 
-_OLDEST_METADATA = pl.col("retrieved_at").rank("ordinal") <= 1_500
+_OLDEST_METADATA = (
+    pl.col("retrieved_at") <= pl.col("retrieved_at").bottom_k(1_500).max()
+)
 _MISSING_METADATA = pl.col("retrieved_at").is_null()
 
 
@@ -376,12 +418,20 @@ def _backfill_metadata(df: pl.LazyFrame) -> pl.LazyFrame:
 
 
 def _discover_guids(plex_df: pl.LazyFrame) -> pl.LazyFrame:
-    return (
-        plex_df.pipe(update_or_append, plex_library_guids(), on="key")
-        .pipe(update_or_append, wikidata_plex_guids(), on="key")
-        .pipe(update_or_append, wikidata_search_guids(), on="key")
-        .pipe(_sort)
+    discovered_df = (
+        pl.concat(
+            [
+                plex_df.select("key", "type"),
+                plex_library_guids(),
+                wikidata_plex_guids(),
+                wikidata_search_guids(),
+            ],
+            how="diagonal",
+        )
+        .group_by("key")
+        .agg(pl.col("type").drop_nulls().last())
     )
+    return plex_df.pipe(update_or_append, discovered_df, on="key").pipe(_sort)
 
 
 def _log_retrieved_at(df: pl.DataFrame) -> pl.DataFrame:
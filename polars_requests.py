@@ -1,11 +1,14 @@
 import time
 from collections.abc import Callable, Iterable
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
 from typing import ParamSpec, TypedDict, TypeVar
+from urllib.parse import quote
 
 import backoff
 import polars as pl
 import requests as _requests
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from tqdm import tqdm
 
 from actions import log_group as _log_group
@@ -17,12 +20,6 @@ class _HTTPDict(TypedDict):
     value: str
 
 
-def _make_header_dict(headers: list[_HTTPDict] | None) -> dict[str, str]:
-    if not headers:
-        return {}
-    return {h["name"]: h["value"] for h in headers}
-
-
 def _make_header_list(headers: dict[str, str]) -> list[_HTTPDict]:
     return [{"name": name, "value": value} for name, value in headers.items()]
 
@@ -32,16 +29,32 @@ class _HTTPRequest(TypedDict):
     headers: list[_HTTPDict] | None
 
 
+_HTTPRequestKey = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def _make_request_key(request: _HTTPRequest | None) -> _HTTPRequestKey | None:
+    if not request or not request["url"]:
+        return None
+    headers = tuple((h["name"], h["value"]) for h in request["headers"] or [])
+    return (request["url"], headers)
+
+
 class _HTTPResponse(TypedDict):
     status: int
     headers: list[_HTTPDict]
     data: bytes
 
 
-def _make_http_response(response: _requests.Response) -> _HTTPResponse:
+def _make_http_response(
+    response: _requests.Response,
+    keep_headers: frozenset[str] | None,
+) -> _HTTPResponse:
+    headers = dict(response.headers)
+    if keep_headers is not None:
+        headers = {n: v for n, v in headers.items() if n.lower() in keep_headers}
     return {
         "status": response.status_code,
-        "headers": _make_header_list(dict(response.headers)),
+        "headers": _make_header_list(headers),
         "data": response.content,
     }
 
@@ -87,24 +100,40 @@ def _decorate_backoff(fn: Callable[P, T], max_retries: int) -> Callable[P, T]:
         return fn
 
 
+@cache
+def _session(pool_maxsize: int) -> _requests.Session:
+    # Shared across batches so keep-alive connections outlive a single map_batches call
+    session = _requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def _request_series(
     requests: pl.Series,
     log_group: str,
     timeout: float,
     min_time: float,
-    ok_statuses: set[int],
-    bad_statuses: set[int],
+    ok_statuses: frozenset[int],
+    bad_statuses: frozenset[int],
     retry_count: int,
+    max_workers: int,
+    keep_headers: frozenset[str] | None,
 ) -> pl.Series:
     assert len(requests) < 50_000, f"Too many requests: {len(requests):,}"
 
     if len(requests) == 0:
         return pl.Series(name="response", values=[], dtype=HTTP_RESPONSE_DTYPE)
 
-    session = _requests.Session()
-    disable_tqdm = len(requests) <= 1
+    request_keys = [_make_request_key(request) for request in requests]
+    unique_request_keys = list(dict.fromkeys(k for k in request_keys if k))
+
+    session = _session(pool_maxsize=max(max_workers, DEFAULT_POOLSIZE))
+    session.cookies.clear()
+    disable_tqdm = len(unique_request_keys) <= 1
 
-    response_codes: list[int | None] = [None] * len(requests)
+    response_codes: list[int | None] = [None] * len(unique_request_keys)
 
     def request_with_retry(
         request_id: int,
@@ -149,24 +178,32 @@ def _request_series(
 
     request_with_retry = _decorate_backoff(request_with_retry, retry_count)
 
-    values: list[_HTTPResponse | None] = []
-    with _log_group(log_group):
-        request_id = 0
-        for request_ in tqdm(requests, unit="url", disable=disable_tqdm):
-            request: _HTTPRequest = request_
-            response = None
-            if request and request["url"]:
-                r = request_with_retry(
-                    request_id,
-                    request["url"],
-                    _make_header_dict(request["headers"]),
-                )
-                response = _make_http_response(r)
-            request_id += 1
-            values.append(response)
-
-        session.close()
+    def fetch(request_id: int, request_key: _HTTPRequestKey) -> _HTTPResponse:
+        url, headers = request_key
+        r = request_with_retry(request_id, url, dict(headers))
+        return _make_http_response(r, keep_headers=keep_headers)
 
+    responses: dict[_HTTPRequestKey, _HTTPResponse] = {}
+    with _log_group(log_group):
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            results = executor.map(
+                fetch, range(len(unique_request_keys)), unique_request_keys
+            )
+            for request_key, response in zip(
+                unique_request_keys,
+                tqdm(
+                    results,
+                    total=len(unique_request_keys),
+                    unit="url",
+                    disable=disable_tqdm,
+                ),
+            ):
+                responses[request_key] = response
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    values = [responses[k] if k else None for k in request_keys]
     return pl.Series(name="response", values=values, dtype=HTTP_RESPONSE_DTYPE)
 
 
@@ -178,7 +215,13 @@ def request(
     ok_statuses: Iterable[int] = [200],
     bad_statuses: Iterable[int] = [],
     retry_count: int = 0,
+    max_workers: int = 1,
+    keep_headers: Iterable[str] | None = None,
 ) -> pl.Expr:
+    assert max_workers >= 1
+    keep_header_names = None
+    if keep_headers is not None:
+        keep_header_names = frozenset(name.lower() for name in keep_headers)
     # MARK: pl.Expr.map_batches
     return requests.map_batches(
         partial(
@@ -186,9 +229,11 @@ def request(
             log_group=log_group,
             timeout=timeout,
             min_time=min_time,
-            ok_statuses=set(ok_statuses),
-            bad_statuses=set(bad_statuses),
+            ok_statuses=frozenset(ok_statuses),
+            bad_statuses=frozenset(bad_statuses),
             retry_count=retry_count,
+            max_workers=max_workers,
+            keep_headers=keep_header_names,
         ),
         return_dtype=HTTP_RESPONSE_DTYPE,
     ).alias("response")
@@ -221,6 +266,23 @@ def _wrap_lit_expr(value: str | pl.Expr) -> pl.Expr:
     return value
 
 
+_QUERY_RESERVED_CHARS = ["%", "&", "#", "+", "="]
+
+
+def _query_value_template(value: str | pl.Expr) -> str:
+    # Quoted literals never contain "{}" so they can be inlined into the format
+    if isinstance(value, str):
+        return quote(value, safe="")
+    return "{}"
+
+
+def _escape_query_value(value: pl.Expr) -> pl.Expr:
+    return value.cast(pl.Utf8).str.replace_many(
+        _QUERY_RESERVED_CHARS,
+        [quote(c, safe="") for c in _QUERY_RESERVED_CHARS],
+    )
+
+
 def prepare_request(
     url: pl.Expr | str,
     fields: dict[str, pl.Expr | str] = {},
@@ -229,8 +291,13 @@ def prepare_request(
     url = _wrap_lit_expr(url)
 
     if fields:
-        f_string = "{}?" + "&".join(name + "={}" for name in fields)
-        field_values = [_wrap_lit_expr(v) for v in fields.values()]
+        f_string = "{}?" + "&".join(
+            quote(name, safe="") + "=" + _query_value_template(value)
+            for name, value in fields.items()
+        )
+        field_values = [
+            _escape_query_value(v) for v in fields.values() if isinstance(v, pl.Expr)
+        ]
         url = pl.format(f_string, url, *field_values)
 
     expr = pl.struct(
@@ -258,11 +325,13 @@ def response_header_value(response: pl.Expr, name: str) -> pl.Expr:
 
 
 def response_date(response: pl.Expr) -> pl.Expr:
+    # Skip the leading "Sun, " so strptime can take its fixed width fast path
     return (
         response.pipe(response_header_value, name="Date")
+        .str.slice(5, 20)
         .str.strptime(
             pl.Datetime(time_unit="ms"),
-            "%a, %d %b %Y %H:%M:%S %Z",
+            "%d %b %Y %H:%M:%S",
             strict=True,
         )
         .alias("response_date")
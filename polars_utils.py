@@ -1,4 +1,3 @@
-import atexit
 import datetime
 import gzip
 import html
@@ -7,10 +6,10 @@ import random
 import sys
 import xml.etree.ElementTree as ET
 import zlib
-from collections.abc import Callable, Iterator
-from functools import partial
-from pathlib import Path
-from typing import Any, TextIO, TypedDict, TypeVar
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
+from typing import Any, TextIO, TypeVar
 
 import numpy as np
 import polars as pl
@@ -40,17 +39,20 @@ def github_step_summary() -> TextIO:
         return sys.stderr
 
 
-class _PyformatRow(TypedDict):
-    args: list[Any]
-    kwargs: dict[str, Any]
-
-
 def apply_with_tqdm(
     expr: pl.Expr,
     function: Callable[[Any], Any],
     return_dtype: PolarsDataType | None = None,
     log_group: str = "apply(unknown)",
+    max_workers: int = 1,
 ) -> pl.Expr:
+    assert max_workers >= 1
+
+    def apply_item(item: Any) -> Any:
+        if item is None:
+            return None
+        return function(item)
+
     def apply_function(s: pl.Series) -> list[Any]:
         values: list[Any] = []
         size = len(s)
@@ -59,11 +61,13 @@ def apply_with_tqdm(
             return values
 
         with _log_group(log_group):
-            for item in tqdm(s, unit="row"):
-                if item is None:
-                    values.append(None)
-                else:
-                    values.append(function(item))
+            if max_workers > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    results = executor.map(apply_item, s)
+                    values.extend(tqdm(results, total=size, unit="row"))
+            else:
+                for item in tqdm(s, unit="row"):
+                    values.append(apply_item(item))
 
         return values
 
@@ -111,43 +115,6 @@ def map_streaming(
     return ldf.map_batches(map_func, schema=return_schema)
 
 
-def pyformat(
-    format_string: str,
-    *args: pl.Expr | str,
-    **kwargs: pl.Expr | str,
-) -> pl.Expr:
-    def _format(row: _PyformatRow) -> str | None:
-        row_args = row.get("args", [])
-        row_kwargs = row.get("kwargs", {})
-
-        if any(v is None for v in row_args):
-            return None
-        elif any(v is None for v in row_kwargs.values()):
-            return None
-        else:
-            return format_string.format(*row_args, **row_kwargs)
-
-    packed_expr: pl.Expr
-    if len(args) > 0 and len(kwargs) > 0:
-        packed_expr = pl.struct(
-            args=pl.concat_list(*args),
-            kwargs=pl.struct(**kwargs),  # type: ignore
-        )
-    elif len(args) > 0 and len(kwargs) == 0:
-        packed_expr = pl.struct(args=pl.concat_list(*args))
-    elif len(args) == 0 and len(kwargs) > 0:
-        packed_expr = pl.struct(kwargs=pl.struct(**kwargs))  # type: ignore
-    else:
-        raise ValueError("must provide at least one argument")
-
-    return packed_expr.pipe(
-        apply_with_tqdm,
-        _format,
-        return_dtype=pl.Utf8,
-        log_group="pyformat",
-    )
-
-
 _INDICATOR_EXPR = (
     pl.when(pl.col("_merge_left") & pl.col("_merge_right"))
     .then(pl.lit("both", dtype=pl.Categorical))
@@ -217,37 +184,35 @@ def _dtype_str_repr(dtype: PolarsDataType) -> str:
         return dtype._string_repr(dtype)  # type: ignore
 
 
-def compute_raw_stats(df: pl.DataFrame) -> pl.DataFrame:
-    def _count_columns(column_name: str, expr: pl.Expr) -> pl.DataFrame:
-        df2 = df.select(expr)
-        if df2.is_empty():
-            schema = {"column": pl.Utf8, column_name: pl.UInt32}
-            return pl.DataFrame(schema=schema)
-        return df2.transpose(include_header=True, column_names=[column_name])
-
-    null_count_df = _count_columns("null_count", pl.all().null_count())
-    is_unique_df = _count_columns(
-        "is_unique",
-        _COL_SUPPORTS_UNIQUE.drop_nulls().is_unique().all(),
-    )
-    true_count_df = _count_columns("true_count", pl.col(pl.Boolean).drop_nulls().sum())
-    false_count_df = _count_columns(
-        "false_count", pl.col(pl.Boolean).drop_nulls().not_().sum()
-    )
+def _dtype_str_col(expr: pl.Expr, schema: pl.Schema) -> pl.Expr:
+    mapping = {name: _dtype_str_repr(dtype) for name, dtype in schema.items()}
+    return expr.replace_strict(mapping, return_dtype=pl.Utf8)
+
+
+def _column_counts(df: pl.DataFrame) -> pl.DataFrame:
+    if df.width == 0:
+        return pl.DataFrame(schema=_COLUMN_COUNTS_SCHEMA)
+
+    # A single select computes every per-column count, keyed "<count>:<column>"
+    row = df.select(
+        pl.all().null_count().name.prefix("null_count:"),
+        _COL_SUPPORTS_UNIQUE.drop_nulls().is_unique().all().name.prefix("is_unique:"),
+        pl.col(pl.Boolean).drop_nulls().sum().name.prefix("true_count:"),
+        pl.col(pl.Boolean).drop_nulls().not_().sum().name.prefix("false_count:"),
+    ).row(0, named=True)
+
+    data: dict[str, list[Any]] = {"column": df.columns}
+    for count_name in list(_COLUMN_COUNTS_SCHEMA)[1:]:
+        data[count_name] = [row.get(f"{count_name}:{col}") for col in df.columns]
+    return pl.DataFrame(data, schema=_COLUMN_COUNTS_SCHEMA)
 
-    joined_df = (
-        null_count_df.join(is_unique_df, on="column", how="left", coalesce=True)
-        .join(true_count_df, on="column", how="left", coalesce=True)
-        .join(false_count_df, on="column", how="left", coalesce=True)
-    )
+
+def compute_raw_stats(df: pl.DataFrame) -> pl.DataFrame:
+    joined_df = _column_counts(df)
 
     return joined_df.select(
         pl.col("column").alias("name"),
-        # MARK: pl.Expr.map_elements
-        pl.col("column")
-        .map_elements(df.schema.get, return_dtype=pl.Object)
-        .map_elements(_dtype_str_repr, return_dtype=pl.String)
-        .alias("dtype"),
+        pl.col("column").pipe(_dtype_str_col, df.schema).alias("dtype"),
         pl.col("null_count"),
         pl.col("true_count"),
         pl.col("false_count"),
@@ -255,6 +220,38 @@ def compute_raw_stats(df: pl.DataFrame) -> pl.DataFrame:
     )
 
 
+def _format_thousands(expr: pl.Expr) -> pl.Expr:
+    # Same as "{:,}", grouping digits from the right by reversing the string
+    return (
+        expr.cast(pl.Utf8)
+        .str.reverse()
+        .str.replace_all(r"(\d{3})", "$1,")
+        .str.reverse()
+        .str.replace(r"^(-?),", "$1")
+    )
+
+
+def _format_percent(count: pl.Expr, total: int) -> pl.Expr:
+    # Like "{:.1%}" of count / total, rounding the exact ratio half to even
+    if total == 0:
+        return pl.lit(None, dtype=pl.Utf8)
+    scaled = count.cast(pl.Int64) * 1000
+    tenths, remainder = scaled // total, scaled % total
+    round_up = (remainder * 2 > total) | ((remainder * 2 == total) & (tenths % 2 == 1))
+    rounded = tenths + round_up.cast(pl.Int64)
+    return pl.format("{}.{}%", rounded // 10, rounded % 10)
+
+
+_COLUMN_COUNTS_SCHEMA = pl.Schema(
+    {
+        "column": pl.Utf8,
+        "null_count": pl.UInt32,
+        "is_unique": pl.Boolean,
+        "true_count": pl.UInt32,
+        "false_count": pl.UInt32,
+    }
+)
+
 _COL_SUPPORTS_UNIQUE = (
     cs.binary() | cs.boolean() | cs.numeric() | cs.string() | cs.temporal()
 )
@@ -264,32 +261,16 @@ def compute_stats(
     df: pl.DataFrame,
     changes_df: pl.DataFrame | None = None,
 ) -> pl.DataFrame:
-    def _count_columns(column_name: str, expr: pl.Expr) -> pl.DataFrame:
-        df2 = df.select(expr)
-        if df2.is_empty():
-            schema = {"column": pl.Utf8, column_name: pl.UInt32}
-            return pl.DataFrame(schema=schema)
-        return df2.transpose(include_header=True, column_names=[column_name])
-
     count = len(df)
-    null_count_df = _count_columns("null_count", pl.all().null_count())
-    is_unique_df = _count_columns(
-        "is_unique",
-        _COL_SUPPORTS_UNIQUE.drop_nulls().is_unique().all(),
-    )
-    true_count_df = _count_columns("true_count", pl.col(pl.Boolean).drop_nulls().sum())
-    false_count_df = _count_columns(
-        "false_count", pl.col(pl.Boolean).drop_nulls().not_().sum()
-    )
 
     def _percent_col(name: str) -> pl.Expr:
         return (
             pl.when(pl.col(f"{name}_count") > 0)
             .then(
-                pyformat(
-                    "{:,.0f} ({:.1%})",
-                    pl.col(f"{name}_count"),
-                    pl.col(f"{name}_count") / count,
+                pl.format(
+                    "{} ({})",
+                    pl.col(f"{name}_count").pipe(_format_thousands),
+                    pl.col(f"{name}_count").pipe(_format_percent, count),
                 )
             )
             .otherwise(None)
@@ -299,16 +280,12 @@ def compute_stats(
     def _int_col(name: str) -> pl.Expr:
         return (
             pl.when(pl.col(f"{name}_count") > 0)
-            .then(pyformat("{:,}", pl.col(f"{name}_count")))
+            .then(pl.col(f"{name}_count").pipe(_format_thousands))
             .otherwise(None)
             .alias(name)
         )
 
-    joined_df = (
-        null_count_df.join(is_unique_df, on="column", how="left", coalesce=True)
-        .join(true_count_df, on="column", how="left", coalesce=True)
-        .join(false_count_df, on="column", how="left", coalesce=True)
-    )
+    joined_df = _column_counts(df)
 
     if changes_df is not None:
         updated_count_df = changes_df.select(
@@ -322,11 +299,7 @@ def compute_stats(
 
     return joined_df.select(
         pl.col("column").alias("name"),
-        # MARK: pl.Expr.map_elements
-        pl.col("column")
-        .map_elements(df.schema.get, return_dtype=pl.Object)
-        .map_elements(_dtype_str_repr, return_dtype=pl.String)
-        .alias("dtype"),
+        pl.col("column").pipe(_dtype_str_col, df.schema).alias("dtype"),
         _percent_col("null"),
         _percent_col("true"),
         _percent_col("false"),
@@ -437,20 +410,19 @@ def position_weights() -> pl.Expr:
     return weights.reverse()
 
 
-def _weighted_random(s: pl.Series) -> pl.Series:
-    size = len(s)
-    values = np.random.choice(size, size=size, replace=False, p=s)
-    return pl.Series(values=values, dtype=pl.UInt32)
-
-
-def weighted_random(weights: pl.Expr) -> pl.Expr:
-    # MARK: pl.Expr.map_batches
-    return weights.map_batches(_weighted_random, return_dtype=pl.UInt32)
+def _weighted_random_keys(s: pl.Series) -> pl.Series:
+    # Exponential keys scaled by weight give a weighted permutation when sorted
+    # (Efraimidis-Spirakis), without np.random.choice's rejection loop
+    keys = np.random.exponential(size=len(s)) / s.to_numpy()
+    return pl.Series(values=keys, dtype=pl.Float64)
 
 
 def weighted_sample(df: SomeFrame, n: int) -> SomeFrame:
-    weighted_args = position_weights().pipe(weighted_random)
-    return df.sort(by=weighted_args).head(n=n)
+    # MARK: pl.Expr.map_batches
+    weighted_keys = position_weights().map_batches(
+        _weighted_random_keys, return_dtype=pl.Float64
+    )
+    return df.bottom_k(n, by=weighted_keys)
 
 
 def sample(
@@ -556,7 +528,7 @@ def _update_or_append(df: pl.DataFrame, other: pl.DataFrame, on: str) -> pl.Data
     other = other.join(df.drop(other_cols), on=on, how="left", coalesce=True).select(
         df.columns
     )
-    return pl.concat([df, other]).unique(subset=on, keep="last", maintain_order=True)
+    return pl.concat([df.join(other, on=on, how="anti", maintain_order="left"), other])
 
 
 def update_or_append(
@@ -597,20 +569,67 @@ def csv_extract(
 XMLValue = dict[str, "XMLValue"] | list["XMLValue"] | str | int | float | None
 
 
+_XMLField = tuple[bool, PolarsDataType, Callable[[str], XMLValue]]
+
+
+def _xml_text_parser(dtype: PolarsDataType) -> Callable[[str], XMLValue]:
+    if dtype == pl.Int64:
+        return int
+    elif dtype == pl.Float64:
+        return float
+    else:
+        return str
+
+
+@cache
+def _xml_struct_fields(dtype: pl.Struct) -> dict[str, _XMLField]:
+    fields: dict[str, _XMLField] = {}
+    for field in dtype.fields:
+        if isinstance(field.dtype, pl.List):
+            inner_dtype = field.dtype.inner
+            assert inner_dtype
+            assert not isinstance(inner_dtype, pl.List)
+            fields[field.name] = (True, inner_dtype, _xml_text_parser(inner_dtype))
+        else:
+            fields[field.name] = (False, field.dtype, _xml_text_parser(field.dtype))
+    return fields
+
+
 def _xml_element_struct_field(
     element: ET.Element,
     dtype: pl.Struct,
 ) -> dict[str, XMLValue]:
+    fields = _xml_struct_fields(dtype)
+    values: dict[str, list[XMLValue]] = {name: [] for name in fields}
+
+    for name in fields:
+        if name in element.attrib:
+            values[name].append(element.attrib[name])
+
+    # Walk the children once and route each into its field, rather than
+    # rescanning every child for every field
+    for child in element:
+        # strip xml namespace
+        tag = child.tag.split("}")[-1]
+
+        if tag not in fields:
+            continue
+
+        is_list, field_dtype, parse_text = fields[tag]
+        if not is_list and values[tag]:
+            # Only the first value of a scalar field is kept
+            continue
+        elif isinstance(field_dtype, pl.Struct):
+            values[tag].append(_xml_element_struct_field(child, field_dtype))
+        elif child.text and child.text.strip():
+            values[tag].append(parse_text(child.text))
+
     obj: dict[str, XMLValue] = {}
-    for field in dtype.fields:
-        if isinstance(field.dtype, pl.List):
-            inner_dtype = field.dtype.inner
-            assert inner_dtype
-            values = _xml_element_field_iter(element, field.name, inner_dtype)
-            obj[field.name] = list(values)
+    for name, (is_list, _, _) in fields.items():
+        if is_list:
+            obj[name] = values[name]
         else:
-            values = _xml_element_field_iter(element, field.name, field.dtype)
-            obj[field.name] = next(values, None)
+            obj[name] = values[name][0] if values[name] else None
     return obj
 
 
@@ -642,60 +661,79 @@ def xml_extract(
     )
 
 
-def _xml_element_field_iter(
-    element: ET.Element,
-    name: str,
-    dtype: PolarsDataType,
-) -> Iterator[dict[str, XMLValue] | str | int | float]:
-    assert not isinstance(dtype, pl.List)
-
-    if name in element.attrib:
-        yield element.attrib[name]
-
-    for child in element:
-        # strip xml namespace
-        tag = child.tag.split("}")[-1]
-
-        if tag == name:
-            if isinstance(dtype, pl.Struct):
-                yield _xml_element_struct_field(child, dtype)
-            elif child.text and child.text.strip():
-                if dtype == pl.Int64:
-                    yield int(child.text)
-                elif dtype == pl.Float64:
-                    yield float(child.text)
-                else:
-                    yield child.text
+def _map_where(
+    s: pl.Series,
+    mask: pl.Series,
+    function: Callable[[Any], Any],
+    other: pl.Series | None = None,
+) -> pl.Series:
+    values: list[Any] = [None] * len(s)
+    for i, item in zip(mask.arg_true(), s.filter(mask)):
+        values[i] = function(item)
+    if other is None:
+        other = s
+    return pl.Series(values=values, dtype=s.dtype).zip_with(mask, other)
+
+
+_COMMON_HTML_ENTITIES = {
+    "&amp;": "&",
+    "&lt;": "<",
+    "&gt;": ">",
+    "&quot;": '"',
+    "&apos;": "'",
+    "&#39;": "'",
+    "&#x27;": "'",
+    "&nbsp;": "\xa0",
+}
+
+
+def _html_unescape_series(s: pl.Series) -> pl.Series:
+    # Strings whose only entities are common ones are decoded natively in a
+    # single replace_many pass, anything else goes through html.unescape
+    patterns = list(_COMMON_HTML_ENTITIES.keys())
+    replacements = list(_COMMON_HTML_ENTITIES.values())
+    mask = (
+        s.str.replace_many(patterns, "")
+        .str.contains("&", literal=True)
+        .fill_null(False)
+    )
+    native = s.str.replace_many(patterns, replacements)
+    return _map_where(s, mask, html.unescape, other=native)
 
 
 def html_unescape(expr: pl.Expr) -> pl.Expr:
-    return apply_with_tqdm(
-        expr,
-        html.unescape,
-        return_dtype=pl.Utf8,
-        log_group="html_unescape",
-    )
+    # MARK: pl.Expr.map_batches
+    return expr.map_batches(_html_unescape_series, return_dtype=pl.Utf8)
 
 
 def _html_unescape_list(lst: list[str]) -> list[str]:
     return [html.unescape(s) for s in lst]
 
 
+def _html_unescape_list_series(s: pl.Series) -> pl.Series:
+    mask = s.list.join("").str.contains("&", literal=True).fill_null(False)
+    return _map_where(s, mask, _html_unescape_list)
+
+
 def html_unescape_list(expr: pl.Expr) -> pl.Expr:
-    return apply_with_tqdm(
-        expr,
-        _html_unescape_list,
+    # MARK: pl.Expr.map_batches
+    return expr.map_batches(
+        _html_unescape_list_series,
         return_dtype=pl.List(pl.Utf8),
-        log_group="html_unescape",
     )
 
 
+# zlib releases the GIL while inflating, so rows decompress in parallel
+_DECOMPRESS_MAX_WORKERS = os.cpu_count() or 1
+
+
 def gzip_decompress(expr: pl.Expr) -> pl.Expr:
     return apply_with_tqdm(
         expr,
         gzip.decompress,
         return_dtype=pl.Binary,
         log_group="gzip_decompress",
+        max_workers=_DECOMPRESS_MAX_WORKERS,
     )
 
 
@@ -709,6 +747,7 @@ def zlib_decompress(expr: pl.Expr) -> pl.Expr:
         _zlib_decompress,
         return_dtype=pl.Utf8,
         log_group="zlib_decompress",
+        max_workers=_DECOMPRESS_MAX_WORKERS,
     )
 
 
@@ -732,17 +771,6 @@ def print_rdf_statements(
         print(line, file=file)
 
 
-_TMPFILES: list[Path] = []
-
-
-def _cleanup_tmpfiles() -> None:
-    for tmpfile in _TMPFILES:
-        tmpfile.unlink(missing_ok=True)
-
-
-atexit.register(_cleanup_tmpfiles)
-
-
 def scan_s3_parquet_anon(uri: str) -> pl.LazyFrame:
     assert uri.startswith("s3://")
     bucket, path = uri[5:].split("/", 1)
@@ -5,6 +5,8 @@ import pytest
 from polars.testing import assert_frame_equal
 
 from plex_etl import (
+    _decode_plex_guid_key,
+    _decode_plex_guid_type,
     fetch_metadata_guids,
     plex_search_guids,
     plex_server,
@@ -24,6 +26,42 @@ def teardown_module() -> None:
     pl.disable_string_cache()
 
 
+def test_decode_plex_guid() -> None:
+    guids = [
+        "plex://movie/5d776be17a53e9001e732ab9",
+        "plex://show/5d9c0874ffd9ef001e99607a",
+        "plex://movie/5D776BE17A53E9001E732AB9",
+        "plex://movie/5d776be17a53e9001e732abz",
+        "plex://artist/5d776be17a53e9001e732ab9",
+        "plex://movie-5d776be17a53e9001e732ab9",
+        "5d776be17a53e9001e732ab9",
+        None,
+    ]
+    df = pl.DataFrame({"guid": guids}).select(
+        pl.col("guid").pipe(_decode_plex_guid_type).alias("type"),
+        pl.col("guid").pipe(_decode_plex_guid_key).alias("key"),
+    )
+    df2 = pl.DataFrame(
+        {
+            "type": pl.Series(
+                ["movie", "show", None, None, None, None, None, None],
+                dtype=pl.Categorical,
+            ),
+            "key": [
+                bytes.fromhex("5d776be17a53e9001e732ab9"),
+                bytes.fromhex("5d9c0874ffd9ef001e99607a"),
+                None,
+                None,
+                None,
+                None,
+                None,
+                None,
+            ],
+        }
+    )
+    assert_frame_equal(df, df2)
+
+
 def test_wikidata_plex_guids() -> None:
     ldf = wikidata_plex_guids()
     assert ldf.collect_schema() == pl.Schema({"key": pl.Binary})
@@ -1,3 +1,4 @@
+from datetime import date
 from typing import Any
 
 import polars as pl
@@ -293,6 +294,55 @@ def test_request_retry_status() -> None:
     assert_frame_equal(ldf, ldf2)
 
 
+def test_request_max_workers() -> None:
+    response_dtype = pl.Struct({"args": pl.Struct({"foo": pl.Utf8})})
+    ldf = pl.LazyFrame(
+        {"url": [f"https://postman-echo.com/get?foo={i}" for i in range(5)]}
+    ).select(
+        pl.col("url")
+        .pipe(prepare_request)
+        .pipe(request, log_group="postman", max_workers=3)
+        .pipe(response_text)
+        .str.json_decode(response_dtype)
+        .struct.field("args")
+        .struct.field("foo")
+        .alias("foo"),
+    )
+    ldf2 = pl.LazyFrame({"foo": ["0", "1", "2", "3", "4"]})
+    assert_frame_equal(ldf, ldf2)
+
+
+def test_request_duplicate_urls() -> None:
+    response_dtype = pl.Struct({"args": pl.Struct({"foo": pl.Utf8})})
+    ldf = pl.LazyFrame(
+        {"url": [f"https://postman-echo.com/get?foo={i % 2}" for i in range(4)]}
+    ).select(
+        pl.col("url")
+        .pipe(prepare_request)
+        .pipe(request, log_group="postman")
+        .pipe(response_text)
+        .str.json_decode(response_dtype)
+        .struct.field("args")
+        .struct.field("foo")
+        .alias("foo"),
+    )
+    ldf2 = pl.LazyFrame({"foo": ["0", "1", "0", "1"]})
+    assert_frame_equal(ldf, ldf2)
+
+
+def test_request_keep_headers() -> None:
+    ldf = pl.LazyFrame({"url": ["https://postman-echo.com/get"]}).select(
+        pl.col("url")
+        .pipe(prepare_request)
+        .pipe(request, log_group="postman", keep_headers=["Date"])
+        .struct.field("headers")
+        .list.eval(pl.element().struct.field("name"))
+        .alias("header_names")
+    )
+    ldf2 = pl.LazyFrame({"header_names": [["Date"]]})
+    assert_frame_equal(ldf, ldf2)
+
+
 def test_request_timeout() -> None:
     ldf = pl.LazyFrame(
         {
@@ -333,6 +383,35 @@ def test_prepare_request(
     assert df.collect_schema() == pl.Schema({"request": HTTP_REQUEST_DTYPE})
 
 
+def test_prepare_request_escapes_fields() -> None:
+    df = pl.DataFrame({"q": ["Fast & Furious", "100%"]}).select(
+        prepare_request(
+            "https://example.com/search",
+            fields={"query": pl.col("q"), "types": "movies,tv"},
+        )
+        .struct.field("url")
+        .alias("url")
+    )
+    assert df["url"].to_list() == [
+        "https://example.com/search?query=Fast %26 Furious&types=movies%2Ctv",
+        "https://example.com/search?query=100%25&types=movies%2Ctv",
+    ]
+
+
+def test_prepare_request_non_string_fields() -> None:
+    df = pl.DataFrame({"d": [date(2023, 1, 2)], "n": [42]}).select(
+        prepare_request(
+            "https://example.com/changes",
+            fields={"start_date": pl.col("d"), "page": pl.col("n")},
+        )
+        .struct.field("url")
+        .alias("url")
+    )
+    assert df["url"].to_list() == [
+        "https://example.com/changes?start_date=2023-01-02&page=42",
+    ]
+
+
 @given(
     responses=series(
         dtype=HTTP_RESPONSE_DTYPE,
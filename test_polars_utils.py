@@ -15,14 +15,14 @@ from polars_utils import (
     compute_stats,
     csv_extract,
     frame_diff,
+    html_unescape,
+    html_unescape_list,
     map_streaming,
     merge_with_indicator,
     now,
     position_weights,
-    pyformat,
     sample,
     update_or_append,
-    weighted_random,
     weighted_sample,
     xml_extract,
 )
@@ -51,31 +51,6 @@ def assert_called_once() -> Callable[[T], T]:
     return mock
 
 
-def test_pyformat() -> None:
-    df = pl.DataFrame({"a": ["a", "b", "c"], "b": [1, 2, 3]})
-
-    df1 = df.select([pyformat("foo_{}_bar_{}", pl.col("a"), "b").alias("fmt")])
-    df2 = pl.DataFrame({"fmt": ["foo_a_bar_1", "foo_b_bar_2", "foo_c_bar_3"]})
-    assert_frame_equal(df1, df2)
-
-    df1 = df.select([pyformat("foo_{0}_bar_{1}", pl.col("a"), "b").alias("fmt")])
-    df2 = pl.DataFrame({"fmt": ["foo_a_bar_1", "foo_b_bar_2", "foo_c_bar_3"]})
-    assert_frame_equal(df1, df2)
-
-    df1 = df.select([pyformat("foo_{a}_bar_{b}", a=pl.col("a"), b="b").alias("fmt")])
-    df2 = pl.DataFrame({"fmt": ["foo_a_bar_1", "foo_b_bar_2", "foo_c_bar_3"]})
-    assert_frame_equal(df1, df2)
-
-    df1 = df.select([pyformat("foo_{}_bar_{b}", pl.col("a"), b="b").alias("fmt")])
-    df2 = pl.DataFrame({"fmt": ["foo_a_bar_1", "foo_b_bar_2", "foo_c_bar_3"]})
-    assert_frame_equal(df1, df2)
-
-    df = pl.DataFrame({"a": ["a", None, "c"], "b": [1, 2, None]})
-    df1 = df.select([pyformat("foo_{}_bar_{}", pl.col("a"), "b").alias("fmt")])
-    df2 = pl.DataFrame({"fmt": ["foo_a_bar_1", None, None]})
-    assert_frame_equal(df1, df2)
-
-
 def test_merge_with_indicator() -> None:
     df1 = pl.LazyFrame({"a": [1, 2, 3], "b": [1, 2, 3]}).map_batches(
         assert_called_once()
@@ -147,18 +122,6 @@ def test_position_weights() -> None:
     )
 
 
-def test_weighted_random() -> None:
-    df = (
-        pl.DataFrame({"a": [1, 2, 3]})
-        .with_columns(
-            position_weights().pipe(weighted_random).alias("sort_arg"),
-        )
-        .sort("sort_arg")
-    )
-    assert df.collect_schema() == pl.Schema({"a": pl.Int64, "sort_arg": pl.UInt32})
-    assert len(df) == 3
-
-
 def test_weighted_sample() -> None:
     df = pl.LazyFrame({"a": [1, 2, 3]}).pipe(weighted_sample, n=2).collect()
     assert len(df) == 2
@@ -223,6 +186,48 @@ def test_xml_extract() -> None:
     assert_frame_equal(df, df2)
 
 
+def test_xml_extract_first_value() -> None:
+    xml = """
+    <data>
+        <movie><year>2008</year><year>n/a</year></movie>
+        <movie><year></year><year>2011</year></movie>
+    </data>
+    """
+    dtype = pl.List(pl.Struct({"year": pl.Int64}))
+
+    df = (
+        pl.DataFrame({"xml": [xml]})
+        .select(pl.col("xml").pipe(xml_extract, dtype).alias("movie"))
+        .explode("movie")
+        .unnest("movie")
+    )
+
+    df2 = pl.DataFrame({"year": [2008, 2011]})
+
+    assert_frame_equal(df, df2)
+
+
+def test_html_unescape() -> None:
+    df = pl.DataFrame(
+        {
+            "title": ["Fast &amp; Furious", "Plain", None, "Rock &#39;n&#39; Roll"],
+            "genres": [["R&amp;B", "Pop"], ["Jazz"], None, []],
+        }
+    ).select(
+        pl.col("title").pipe(html_unescape),
+        pl.col("genres").pipe(html_unescape_list),
+    )
+
+    df2 = pl.DataFrame(
+        {
+            "title": ["Fast & Furious", "Plain", None, "Rock 'n' Roll"],
+            "genres": [["R&B", "Pop"], ["Jazz"], None, []],
+        }
+    )
+
+    assert_frame_equal(df, df2)
+
+
 def test_align_to_index() -> None:
     df1 = pl.LazyFrame([], schema={"id": pl.Int64})
     assert_frame_equal(align_to_index(df1, name="id"), df1)
@@ -482,6 +487,21 @@ def test_apply_with_tqdm() -> None:
     assert_frame_equal(df2, df3)
 
 
+def test_apply_with_tqdm_max_workers() -> None:
+    df1 = pl.LazyFrame({"s": [1, None, 3, 4, 5]})
+    df2 = pl.LazyFrame({"s": [2, None, 4, 5, 6]})
+    df3 = df1.select(
+        apply_with_tqdm(
+            pl.col("s"),
+            lambda x: x + 1,
+            return_dtype=pl.Int64,
+            log_group="test",
+            max_workers=4,
+        )
+    )
+    assert_frame_equal(df2, df3)
+
+
 @given(s=series(dtype=pl.Int64))
 def test_apply_with_tqdm_properties(s: pl.Series) -> None:
     def fn(a: int) -> int:
@@ -536,3 +556,29 @@ def test_compute_stats() -> None:
     )
     stats_df = compute_stats(df)
     assert len(stats_df) == len(df.columns)
+
+
+def test_compute_stats_formatting() -> None:
+    df = pl.DataFrame({"a": [None] * 1_000 + list(range(15_000))})
+    stats_df = compute_stats(df)
+    assert stats_df.row(0, named=True) == {
+        "name": "a",
+        "dtype": "i64",
+        "null": "1,000 (6.2%)",
+        "true": "",
+        "false": "",
+        "unique": "true",
+        "updated": "",
+    }
+
+    df = pl.DataFrame({"a": pl.Series([], dtype=pl.Int64)})
+    stats_df = compute_stats(df)
+    assert stats_df.row(0, named=True) == {
+        "name": "a",
+        "dtype": "i64",
+        "null": "",
+        "true": "",
+        "false": "",
+        "unique": "true",
+        "updated": "",
+    }
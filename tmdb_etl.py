@@ -30,6 +30,7 @@ _COLUMNS = [
 ]
 
 _API_RETRY_COUNT = 3
+_API_MAX_WORKERS = 8
 
 _IMDB_ID_PATTERN: dict[TMDB_TYPE, str] = {
     "movie": r"tt(\d+)",
@@ -118,6 +119,8 @@ def tmdb_external_ids(df: pl.LazyFrame, tmdb_type: TMDB_TYPE) -> pl.LazyFrame:
                 log_group=f"api.themoviedb.org/3/{tmdb_type}/external_ids",
                 ok_statuses={200, 404},
                 retry_count=_API_RETRY_COUNT,
+                max_workers=_API_MAX_WORKERS,
+                keep_headers=["Date"],
             )
             .alias("response")
         )
@@ -220,6 +223,7 @@ def tmdb_exists(expr: pl.Expr, tmdb_type: _EXISTS_TMDB_TYPE) -> pl.Expr:
             log_group=f"api.themoviedb.org/3/{tmdb_type}",
             ok_statuses={200, 404},
             retry_count=_API_RETRY_COUNT,
+            max_workers=_API_MAX_WORKERS,
         )
         .pipe(response_text)
         .str.json_decode(dtype=pl.Struct([pl.Field("id", pl.UInt32)]))
@@ -252,6 +256,7 @@ def tmdb_find(
             log_group="api.themoviedb.org/3/find",
             ok_statuses={200, 404},
             retry_count=_API_RETRY_COUNT,
+            max_workers=_API_MAX_WORKERS,
         )
         .pipe(response_text)
         .str.json_decode(dtype=_FIND_RESPONSE_DTYPE)